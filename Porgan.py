@@ -1,10 +1,93 @@
 import argparse
 import os
+import sys
 import zipfile
 import shutil
 import re
 import yaml
 import logging
+import json
+import time
+import hashlib
+import filecmp
+import zlib
+import cProfile
+import pstats
+import contextlib
+import threading
+import io
+import errno
+import socket
+import mimetypes
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, runs are not locked there
+    fcntl = None
+
+# a directory mtime this close to the time of the scan may not reflect files created in the same clock tick
+MTIME_RACE_WINDOW_NS = 2_000_000_000
+
+# what to do when a file with the same name already exists in the destination folder/archive
+CONFLICT_POLICIES = ['skip', 'rename', 'keep_newer', 'replace_if_different']
+
+# file names that differ only in case are the same file on the default file systems of Windows and macOS
+CASE_INSENSITIVE_NAMES = os.name == 'nt' or sys.platform == 'darwin'
+
+# zip entries store their mtime in local time with a resolution of two seconds
+ZIP_MTIME_RESOLUTION = 2
+
+# how hard to make sure moved/archived files reach the disk before originals are removed
+DURABILITY_LEVELS = ['none', 'batched', 'strict']
+
+# what a run does when another run holds the lease on the target directory
+LEASE_CONTENTION_MODES = ['exit', 'wait', 'queue']
+# lock and queue files kept in the target directory, all names starting with this prefix are never organized
+APP_FILE_PREFIX = '.porgan.'
+LOCK_FILE = '.porgan.lock'
+QUEUE_FILE = '.porgan.queue'
+TAKEOVER_FILE = '.porgan.takeover'
+
+# file signatures used to sniff the content type of files with unknown extensions
+MAGIC_SIGNATURES = [
+    (b'%PDF', 'application/pdf'),
+    (b'\x89PNG', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF8', 'image/gif'),
+    (b'ID3', 'audio/mpeg'),
+    (b'OggS', 'audio/ogg'),
+    (b'fLaC', 'audio/flac'),
+    (b'PK\x03\x04', 'application/zip'),
+    (b'\x1f\x8b', 'application/gzip'),
+    (b'7z\xbc\xaf', 'application/x-7z-compressed'),
+    (b'Rar!', 'application/x-rar'),
+    (b'BZh', 'application/x-bzip2'),
+    (b'\xfd7zXZ', 'application/x-xz'),
+    (b'\x7fELF', 'application/x-executable'),
+    (b'MZ', 'application/x-msdownload'),
+    (b'SQLite format 3', 'application/x-sqlite3'),
+]
+# longest suffix after the last dot that is learned as an extension
+MAX_LEARNED_EXTENSION_LENGTH = 10
+# category a learned extension is promoted to, by sniffed content type or its major type
+CONTENT_TYPE_CATEGORIES = {
+    'image': 'images',
+    'audio': 'audio',
+    'video': 'videos',
+    'text': 'documents',
+    'application/pdf': 'documents',
+    'application/zip': 'archives',
+    'application/gzip': 'archives',
+    'application/x-7z-compressed': 'archives',
+    'application/x-rar': 'archives',
+    'application/x-bzip2': 'archives',
+    'application/x-xz': 'archives',
+    'application/x-executable': 'executables',
+    'application/x-msdownload': 'executables',
+    'application/x-sqlite3': 'data',
+    'application/json': 'data',
+    'application/xml': 'data',
+}
 
 class DataFetcher:
     """
@@ -17,6 +100,11 @@ class DataFetcher:
         - get_app_made_zips(): returns a list of archive names from the extensions dictionary
         - get_file_list(target_directory): returns a list of all files in the target directory
         - get_duplicate_files(file_list): finds and returns a list of duplicate files in the given file list
+        - get_categories(file): returns the categories of a file from the compiled extension index
+        - scan(): lists the target directory, reusing the manifest of the previous run in incremental mode
+        - get_file_dictionary(): returns the categorized files of the target directory
+        - get_duplicates(): returns the duplicate and orphaned duplicate files of the target directory
+        - save_manifest(): saves the scan manifest for the next incremental run
         
         Parameters:
             fileIOreporter   (object) - an object that handles logging and reporting
@@ -24,23 +112,99 @@ class DataFetcher:
             extensions_file  (str) - the extensions file to get the extensions dictionary from
             target_directory (str) - the target directory to overwrite the default target directory
                 if None, the default target directory will be used
+            full_scan        (bool) - ignore the manifest of the previous run even if incremental mode is enabled
+            scan_on_init     (bool) - scan the target directory when the object is created
         """
-    def __init__(self, fileIOreporter, settings_file, path_to_extensions_file, target_directory = None ): 
+    def __init__(self, fileIOreporter, settings_file, path_to_extensions_file, target_directory = None, full_scan = False, scan_on_init = True): 
         """
             parameters:
                - fileIOreporter (object) - an object that handles logging and reporting
                - settings_file (str) - the settings file to get the default target directory from
                - extensions_file (str) - the extensions file to get the extensions dictionary from
                - target_directory (str) - the target directory to overwrite the default target directory
+               - full_scan (bool) - ignore the manifest of the previous run
+               - scan_on_init (bool) - scan the target directory now. If False, scan() must be called before organizing
         """
         self.new_target_directory = ''
         self.reporter = fileIOreporter
         self.settings = self._load_yaml(settings_file)
         self.extensions_dictionary = self._load_yaml(path_to_extensions_file)    
         self._set_target_directory(target_directory)
-        # make file_list getter
-        self.file_list = self.get_file_list() 
         self.new_file_extensions = []
+        # extensions learned from unknown files, merged into the extensions dictionary before it is compiled
+        self.learned_extensions_path = self.settings.get('learned_extensions_file') or f'{os.path.splitext(path_to_extensions_file)[0]}.learned.yaml'
+        self._merge_learned_extensions()
+        self._compile_extension_index()
+        self.extension_registry = ExtensionRegistry(os.path.join(self._get_manifest_directory(), 'unknown_extensions.json'),
+                                                    self.learned_extensions_path,
+                                                    self.reporter,
+                                                    min_count = self.settings.get('learn_extensions_min_count', 5),
+                                                    default_category = self.settings.get('learn_extensions_default_category', 'misc'))
+        # incremental mode state, filled by scan()
+        self.incremental = self.settings.get('incremental_mode', False) and not full_scan
+        self.manifest_path = self._get_manifest_path()
+        self.manifest_entries = {}
+        self.directory_mtime = None
+        self.directory_changed = False
+        self.scan_skipped = False
+        # make file_list getter
+        self.file_list = self.scan() if scan_on_init else []
+
+    def _merge_learned_extensions(self):
+        """
+        Adds the extensions in the generated overlay to the extensions dictionary.
+        Extensions that are already in Extensions.yaml keep their category.
+
+        parameters: none
+
+        returns: None
+        """
+        if not os.path.isfile(self.learned_extensions_path):
+            return
+        learned_extensions = self._load_yaml(self.learned_extensions_path) or {}
+        known_extensions = {str(ext).lower() for extensions in self.extensions_dictionary.values() for ext in extensions}
+        for category, extensions in learned_extensions.items():
+            new_extensions = [ext for ext in extensions if str(ext).lower() not in known_extensions]
+            if new_extensions:
+                self.extensions_dictionary.setdefault(category, [])
+                self.extensions_dictionary[category] = self.extensions_dictionary[category] + new_extensions
+                self.reporter.logger.debug(f'Learned extensions in {category}: {new_extensions}')
+
+    def _compile_extension_index(self):
+        """
+        Compiles the extensions dictionary into an index from extension to categories, so classifying a file
+        is one lookup per dot in its name instead of a comparison with every extension.
+        Also saves a hash of the extensions dictionary, a manifest classified with other extensions is not reused.
+
+        parameters: none
+
+        returns: None
+        """
+        self.category_order = {category: n for n, category in enumerate(self.extensions_dictionary)}
+        self.extension_index = {}
+        for category, extensions in self.extensions_dictionary.items():
+            for ext in extensions:
+                categories = self.extension_index.setdefault(str(ext).lower(), [])
+                if category not in categories:
+                    categories.append(category)
+        self.extensions_hash = hashlib.sha1(json.dumps(self.extensions_dictionary, sort_keys=True).encode()).hexdigest()[:16]
+
+    def get_categories(self, file):
+        """
+        Returns the categories of a file, in the order of the extensions dictionary.
+        Every suffix after a dot is looked up, so extensions like tar.gz match.
+
+        parameters: file (str) - the file path
+
+        returns: a list of categories, empty if the extension is unknown
+        """
+        name = os.path.basename(file).lower()
+        categories = set()
+        position = name.find('.')
+        while position != -1:
+            categories.update(self.extension_index.get(name[position + 1:], ()))
+            position = name.find('.', position + 1)
+        return sorted(categories, key=self.category_order.get)
 
     def _load_yaml(self, path_to_file):
         """
@@ -96,7 +260,8 @@ class DataFetcher:
         returns: a list of archive names from the extensions dictionary
         """
         zips = []
-        filenames = list(self.extensions_dictionary.keys())
+        #unknowns is not in the extensions dictionary, but files without a category are archived to it
+        filenames = list(self.extensions_dictionary.keys()) + ['unknowns']
         for file in filenames:
             zips.append(file + '.zip')
         return zips
@@ -125,18 +290,277 @@ class DataFetcher:
         if self.new_target_directory == '':
             self.reporter.logger.error("No target directory provided. Exiting...")
             exit()
-        return [f for f in self._get_absolute_file_paths(self.new_target_directory) if f not in self.get_app_made_zips()]
+        # in incremental mode the file list is tracked in the manifest
+        if self.incremental:
+            return [self._get_absolute_path(name) for name in self.manifest_entries]
+        return [f for f in self._get_absolute_file_paths(self.new_target_directory) if not self._is_app_made_file(os.path.basename(f))]
+    
+    def _get_absolute_path(self, name):
+        return os.path.abspath(os.path.join(self.new_target_directory, name))
+
+    def _get_file_names(self, folder):
+        """
+        Returns the names of the files in the given folder, excluding archives and lock files made by the app.
+        Uses a single scandir so no file in the folder is stat'ed.
+
+        parameters: folder (str) - the folder to list
+
+        returns: a list of file names
+        """
+        app_made_zips = set(self.get_app_made_zips())
+        with os.scandir(folder) as entries:
+            return [entry.name for entry in entries if entry.is_file() and not self._is_app_made_file(entry.name, app_made_zips)]
+
+    def _is_app_made_file(self, name, app_made_zips = None):
+        # archives, their {category}.zip.{pid}.tmp temp files, and the lock/queue files of DirectoryLease
+        if app_made_zips is None:
+            app_made_zips = set(self.get_app_made_zips())
+        if name in app_made_zips or name.startswith(APP_FILE_PREFIX):
+            return True
+        if name.endswith('.tmp') and '.zip.' in name:
+            return name[:name.rindex('.zip.') + len('.zip')] in app_made_zips
+        return False
+
+    def _get_manifest_directory(self):
+        return os.path.expanduser(self.settings.get('manifest_directory', '~/.cache/porgan'))
+
+    def _get_manifest_path(self):
+        """
+        Returns the path of the scan manifest for the target directory.
+        The manifest is kept outside the target directory, as writing it there would change the directory mtime.
+
+        parameters: none
+
+        returns: the path of the manifest file
+        """
+        manifest_directory = self._get_manifest_directory()
+        target_hash = hashlib.sha1(os.path.abspath(self.new_target_directory).encode()).hexdigest()[:16]
+        return os.path.join(manifest_directory, f'manifest-{target_hash}.json')
+
+    def _load_manifest(self):
+        """
+        Loads the scan manifest of the previous run.
+
+        parameters: none
+
+        returns: the manifest dictionary, or None if there is no usable manifest
+        """
+        if not os.path.isfile(self.manifest_path):
+            self.reporter.logger.debug('No manifest found, scanning target directory...')
+            return None
+        try:
+            with open(self.manifest_path, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            self.reporter.logger.warning(f'Could not read manifest {self.manifest_path}, scanning target directory...')
+            return None
+        if manifest.get('target_directory') != os.path.abspath(self.new_target_directory):
+            return None
+        # the files were classified with other extensions, e.g. after new extensions were learned
+        if manifest.get('extensions_hash') != self.extensions_hash:
+            self.reporter.logger.debug('Extensions changed since last run, scanning target directory...')
+            return None
+        return manifest
+
+    def refresh_directory_mtime(self):
+        """
+        Stats the target directory again after this run changed it, so the next run can skip the scan.
+        Must be called while the lease is held. The mtime is only trusted once it is older than
+        MTIME_RACE_WINDOW_NS, so this waits out the rest of the window, and the directory is listed
+        again to make sure no file was added by someone else during the run.
+
+        parameters: none
+
+        returns: None
+        """
+        if not self.incremental or not self.directory_changed:
+            return
+        directory_mtime = os.stat(self.new_target_directory).st_mtime_ns
+        remaining_ns = directory_mtime + MTIME_RACE_WINDOW_NS - time.time_ns()
+        if remaining_ns > 0:
+            time.sleep(remaining_ns / 1e9)
+        directory_mtime = os.stat(self.new_target_directory).st_mtime_ns
+        names = self._get_file_names(self.new_target_directory)
+        if len(names) != len(self.manifest_entries) or any(name not in self.manifest_entries for name in names):
+            self.reporter.logger.debug('Target directory changed during the run, it will be listed again next run.')
+            return
+        if time.time_ns() - directory_mtime > MTIME_RACE_WINDOW_NS:
+            self.directory_mtime = directory_mtime
+            self.directory_changed = False
+
+    def save_manifest(self):
+        """
+        Saves the manifest of this run: the directory mtime, and the classification and duplicate status of each file.
+        If this run changed the target directory and its new mtime could not be trusted, see refresh_directory_mtime,
+        the mtime is not saved, so the next run lists the directory again.
+
+        parameters: none
+
+        returns: None
+        """
+        if not self.incremental:
+            return
+        manifest = {'target_directory': os.path.abspath(self.new_target_directory),
+                    'extensions_hash': self.extensions_hash,
+                    'directory_mtime': None if self.directory_changed else self.directory_mtime,
+                    'entries': self.manifest_entries}
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        #write to a temp file first so an interrupted run cannot leave a truncated manifest
+        temp_path = f'{self.manifest_path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(temp_path, self.manifest_path)
+        self.reporter.logger.debug(f'Manifest saved: {len(self.manifest_entries)} entries.')
+
+    def scan(self):
+        """
+        Scans the target directory and returns its file list.
+        In incremental mode the manifest of the previous run is reused: if the directory mtime has not changed
+        the directory is not listed at all, otherwise only new entries are classified and checked for duplicates.
+
+        parameters: none
+
+        returns: a list of absolute file paths in the target directory
+        """
+        if not self.incremental:
+            return self.get_file_list()
+
+        if self.new_target_directory == '':
+            self.reporter.logger.error("No target directory provided. Exiting...")
+            exit()
+
+        manifest = self._load_manifest()
+        scan_started = time.time_ns()
+        directory_mtime = os.stat(self.new_target_directory).st_mtime_ns
+
+        if manifest is not None and manifest['directory_mtime'] == directory_mtime:
+            self.reporter.logger.info('Target directory unchanged since last run, skipping scan.')
+            self.manifest_entries = manifest['entries']
+            self.directory_mtime = directory_mtime
+            self.scan_skipped = True
+            return self.get_file_list()
+
+        cached_entries = manifest['entries'] if manifest is not None else {}
+        names = self._get_file_names(self.new_target_directory)
+        self.manifest_entries = {name: cached_entries[name] for name in names if name in cached_entries}
+        new_names = [name for name in names if name not in cached_entries]
+        self.reporter.logger.debug(f'Scan: {len(names)} files, {len(new_names)} new since last run.')
+        self._classify_entries(new_names)
+
+        # only trust the mtime if it is old enough that no file can share its clock tick
+        if scan_started - directory_mtime > MTIME_RACE_WINDOW_NS:
+            self.directory_mtime = directory_mtime
+        return self.get_file_list()
+
+    def _classify_entries(self, names):
+        """
+        Classifies new manifest entries and updates the duplicate status of the manifest.
+        Only the new entries, and the entries that were already duplicates or orphans, are checked for duplicates,
+        as a new file can only change the duplicate status of those.
+
+        parameters: names (list) - the names of the new files in the target directory
+
+        returns: None
+        """
+        new_files = [self._get_absolute_path(name) for name in names]
+        for name in names:
+            self.manifest_entries[name] = {'categories': [], 'duplicate': False, 'orphan_pattern': None}
+        for category, files in self.create_file_dictionary(new_files).items():
+            for file in files:
+                entry = self.manifest_entries[os.path.basename(file)]
+                if category not in entry['categories']:
+                    entry['categories'].append(category)
+
+        recheck_names = set(names)
+        recheck_names.update(name for name, entry in self.manifest_entries.items() if entry['duplicate'] or entry['orphan_pattern'])
+        for name in recheck_names:
+            self.manifest_entries[name]['duplicate'] = False
+            self.manifest_entries[name]['orphan_pattern'] = None
+
+        duplicates, orphaned_duplicates = self.get_duplicate_files([self._get_absolute_path(name) for name in recheck_names], self.get_file_list())
+        for file in duplicates:
+            self.manifest_entries[os.path.basename(file)]['duplicate'] = True
+        for file, pattern in orphaned_duplicates:
+            entry = self.manifest_entries[os.path.basename(file)]
+            if entry['orphan_pattern'] is None:
+                entry['orphan_pattern'] = pattern.pattern
+
+    def add_files(self, files):
+        """
+        Adds files created by this run, e.g. renamed orphans, to the manifest.
+
+        parameters: files (list) - absolute paths of the new files
+
+        returns: None
+        """
+        if not files:
+            return
+        self.directory_changed = True
+        if self.incremental:
+            self._classify_entries([os.path.basename(file) for file in files])
+
+    def forget_files(self, files):
+        """
+        Removes files that were moved, archived or removed by this run from the manifest.
+
+        parameters: files (list) - absolute paths of the files
+
+        returns: None
+        """
+        if not files:
+            return
+        self.directory_changed = True
+        for file in files:
+            self.manifest_entries.pop(os.path.basename(file), None)
+
+    def get_file_dictionary(self):
+        """
+        Returns the categorized files of the target directory, see create_file_dictionary.
+        In incremental mode the classification is read from the manifest.
+
+        parameters: none
+
+        returns: a dictionary where each key is a file category and the value is a list of file paths
+        """
+        if not self.incremental:
+            return self.create_file_dictionary(self.get_file_list())
+        file_dictionary = {}
+        for name, entry in self.manifest_entries.items():
+            for category in entry['categories']:
+                file_dictionary.setdefault(category, []).append(self._get_absolute_path(name))
+        return file_dictionary
+
+    def get_duplicates(self):
+        """
+        Returns the duplicate files of the target directory, see get_duplicate_files.
+        In incremental mode the duplicate status is read from the manifest.
+
+        parameters: none
+
+        returns: tuple(list, list<tuple>) - a list of duplicate files and a list of tuples containing an orphan and its regex pattern
+        """
+        if not self.incremental:
+            return self.get_duplicate_files(self.file_list)
+        duplicates = []
+        orphaned_duplicates = []
+        for name, entry in self.manifest_entries.items():
+            if entry['duplicate']:
+                duplicates.append(self._get_absolute_path(name))
+            elif entry['orphan_pattern'] is not None:
+                orphaned_duplicates.append((self._get_absolute_path(name), re.compile(entry['orphan_pattern'])))
+        return duplicates, orphaned_duplicates
     
     def strip_duplicate_pattern(self, file, pattern):
         new_filename = re.sub(pattern, "", file)
         new_filename = new_filename.replace(" ", "")
         return new_filename
     
-    def get_duplicate_files(self, file_list):
+    def get_duplicate_files(self, file_list, existing_files = None):
         """
         Finds and returns a list of duplicate files in the given file list using regex patterns.
 
         parameters: file_list (list) - a list of file paths to search for duplicates
+                    existing_files (list) - the files to look for originals in, if None file_list is used
 
         Returns: tuple(list, list<tuple>) - a list of duplicate files and a list of tuples containing the an orphan and its regex pattern
 
@@ -166,6 +590,7 @@ class DataFetcher:
 
         duplicate_files = []
         matches_with_no_original = []
+        existing_files = set(file_list if existing_files is None else existing_files)
 
         for filename in file_list:
             # Check each pattern
@@ -173,7 +598,7 @@ class DataFetcher:
                 #match = pattern.match(filename)
                 match = re.search(pattern, filename)
                 # If there is a match, and the original file exists, add it to the list
-                if match and self.strip_duplicate_pattern(filename, pattern) in file_list:
+                if match and self.strip_duplicate_pattern(filename, pattern) in existing_files:
                     # if there is a match, and the original exists, add duplicate file to the return list
 
                     duplicate_files.append(filename)
@@ -190,10 +615,9 @@ class DataFetcher:
     def create_file_dictionary(self, file_list):
         """
         Creates a dictionary of files where each key is a file category and the value is a list of the files that belong to that category.
-        Saves a list of previously unknown file extensions to self.new_file_extensions. Currently unused. TODO use this to update the extensions dictionary.
+        Adds previously unknown file extensions to self.new_file_extensions.
 
             parameters: file_list (list): A list of file paths.
-            extensions_category_list (list): A dictionary where each key is a file category and the value is a list of file extensions that belong to that category.
 
         Returns:
             dict: A dictionary where each key is a file category and the value is a list of file paths that belong to that category. Files with unknown file extensions are categorized as 'unknown'.
@@ -203,43 +627,580 @@ class DataFetcher:
         self.reporter.logger.debug("Creating file dictionary...")
 
         file_dictionary = {}
-        check_list = []
+        unknown_files = []
         for file in file_list:
             #if file has no extension
-            if '.' not in file:
-                #do something?
-                # currently gets picked up in the unknowns category
-                # later, check mime/media type for identification.
-                pass
-            for key, val in self.extensions_dictionary.items():
-                for ext in val:
-                    if file.lower().endswith(f'.{ext}'):
-                        if key in file_dictionary:
-                            file_dictionary[key].append(file)
-                        else:
-                            file_dictionary[key] = [file]
-                        if file not in check_list:
-                            check_list.append(file)
+            # it gets picked up in the unknowns category
+            categories = self.get_categories(file)
+            if not categories:
+                unknown_files.append(file)
+            for key in categories:
+                if key in file_dictionary:
+                    file_dictionary[key].append(file)
+                else:
+                    file_dictionary[key] = [file]
         
         #Unknowns go in the unknowns category
-        # create list of unknown types for future use
-        unknown_types = []
-        for file in file_list:
-            if file not in check_list:
-                if 'unknowns' not in file_dictionary:
-                    file_dictionary['unknowns'] = [file]
-                else:
-                    file_dictionary['unknowns'].append(file)
-                ext = file.split('.')[-1]
-                unknown_types.append(ext)
-                #save list of unknown types for future use
-                self.new_file_extensions = unknown_types
+        if unknown_files:
+            file_dictionary['unknowns'] = unknown_files
+        for file in unknown_files:
+            ext = ExtensionRegistry.get_extension(file)
+            #save list of unknown types for future use
+            if ext and ext not in self.new_file_extensions:
+                self.new_file_extensions.append(ext)
         return file_dictionary
     
     def get_target_directory(self):
         return self.new_target_directory
 
 
+class ExtensionRegistry:
+    """
+        Persistent registry of the unknown extensions seen across runs, with their file counts, sizes and sniffed content types.
+        Files are recorded when they are moved or archived into unknowns, so each file is counted once.
+
+        Extensions seen at least min_count times are promoted into a generated overlay on Extensions.yaml
+        (Extensions.learned.yaml), in the category of their most common content type, so later runs classify them
+        instead of re-evaluating them as unknowns. Extensions without a known content type go to default_category.
+
+        parameters:
+            registry_path    (str): The file the registry is saved in.
+            overlay_path     (str): The generated overlay file.
+            fileIOreporter   (object): An object that handles logging and reporting.
+            min_count        (int): How many files with an extension must be seen before it is promoted.
+            default_category (str): Category for extensions without a known content type. If None, they are not promoted.
+    """
+
+    def __init__(self, registry_path, overlay_path, fileIOreporter, min_count = 5, default_category = 'misc'):
+        self.registry_path = registry_path
+        self.overlay_path = overlay_path
+        self.reporter = fileIOreporter
+        self.min_count = min_count
+        self.default_category = default_category
+        # extension -> {'count', 'size', 'content_types': {content_type: count}, 'last_seen'}
+        self.extensions = None
+        self.changed = False
+
+    @staticmethod
+    def get_extension(file):
+        name = os.path.basename(file).lower()
+        if '.' not in name.lstrip('.'):
+            return ''
+        return name.rsplit('.', 1)[-1]
+
+    @staticmethod
+    def is_plausible_extension(ext):
+        # versions like app-1.2.3 or titles like 'Notes v1.5 final' have dots that don't start an extension
+        return 0 < len(ext) <= MAX_LEARNED_EXTENSION_LENGTH and ext.isascii() and ext.isalnum() and not ext.isdigit()
+
+    @staticmethod
+    def sniff_content_type(file):
+        """
+        Guesses the content type of a file from its first bytes, falling back to its name.
+
+        parameters: file (str) - the file path
+
+        returns: a content type, e.g. image/png, or application/octet-stream if it is not recognized
+        """
+        try:
+            with open(file, 'rb') as f:
+                head = f.read(512)
+        except OSError:
+            return 'application/octet-stream'
+        for signature, content_type in MAGIC_SIGNATURES:
+            if head.startswith(signature):
+                return content_type
+        if head[:4] == b'RIFF':
+            return {b'WAVE': 'audio/wav', b'AVI ': 'video/x-msvideo', b'WEBP': 'image/webp'}.get(head[8:12], 'application/octet-stream')
+        if head[4:8] == b'ftyp':
+            return 'video/mp4'
+        content_type, encoding = mimetypes.guess_type(file)
+        if content_type is not None:
+            return content_type
+        if head and b'\0' not in head:
+            try:
+                head.decode('utf-8')
+                return 'text/plain'
+            except UnicodeDecodeError:
+                pass
+        return 'application/octet-stream'
+
+    def load(self):
+        if self.extensions is not None:
+            return
+        self.extensions = {}
+        if os.path.isfile(self.registry_path):
+            try:
+                with open(self.registry_path, 'r') as f:
+                    self.extensions = json.load(f)
+            except (OSError, ValueError):
+                self.reporter.logger.warning(f'Could not read extension registry {self.registry_path}, starting a new one.')
+
+    def record(self, files):
+        """
+        Records files with unknown extensions. Files without a plausible extension are not recorded, see is_plausible_extension.
+
+        parameters: files (list) - paths of the unknown files
+
+        returns: None
+        """
+        if not files:
+            return
+        self.load()
+        now = time.time()
+        for file in files:
+            ext = self.get_extension(file)
+            if not self.is_plausible_extension(ext):
+                continue
+            try:
+                size = os.path.getsize(file)
+            except OSError:
+                continue
+            entry = self.extensions.setdefault(ext, {'count': 0, 'size': 0, 'content_types': {}, 'last_seen': now})
+            content_type = self.sniff_content_type(file)
+            entry['count'] += 1
+            entry['size'] += size
+            entry['content_types'][content_type] = entry['content_types'].get(content_type, 0) + 1
+            entry['last_seen'] = now
+            self.changed = True
+
+    def get_category(self, entry):
+        content_type = max(entry['content_types'], key=entry['content_types'].get)
+        category = CONTENT_TYPE_CATEGORIES.get(content_type) or CONTENT_TYPE_CATEGORIES.get(content_type.split('/')[0])
+        return category or self.default_category
+
+    def get_promoted_extensions(self):
+        """
+        Returns the extensions seen at least min_count times, by category.
+
+        parameters: none
+
+        returns: a dictionary where each key is a category and the value is a sorted list of extensions
+        """
+        self.load()
+        promoted = {}
+        for ext, entry in sorted(self.extensions.items()):
+            # registries saved by earlier versions may hold implausible extensions
+            if entry['count'] < self.min_count or not self.is_plausible_extension(ext):
+                continue
+            category = self.get_category(entry)
+            if category is not None:
+                promoted.setdefault(category, []).append(ext)
+        return promoted
+
+    def save(self):
+        """
+        Saves the registry and regenerates the overlay if new files were recorded.
+
+        parameters: none
+
+        returns: a list of the extensions that were newly promoted
+        """
+        if not self.changed:
+            return []
+        os.makedirs(os.path.dirname(self.registry_path), exist_ok=True)
+        temp_path = f'{self.registry_path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.extensions, f)
+        os.replace(temp_path, self.registry_path)
+        self.changed = False
+
+        previous = {}
+        if os.path.isfile(self.overlay_path):
+            with open(self.overlay_path, 'r') as f:
+                previous = yaml.safe_load(f) or {}
+        promoted = self.get_promoted_extensions()
+        if promoted == previous:
+            return []
+        temp_path = f'{self.overlay_path}.tmp'
+        with open(temp_path, 'w') as f:
+            f.write('#generated by Porgan from the unknown extensions it has seen, do not edit\n')
+            f.write('#to keep or change an entry, move it to Extensions.yaml, which takes precedence\n')
+            yaml.safe_dump(promoted, f, default_flow_style=None, sort_keys=True)
+        os.replace(temp_path, self.overlay_path)
+
+        previous_extensions = {ext for extensions in previous.values() for ext in extensions}
+        new_extensions = [ext for extensions in promoted.values() for ext in extensions if ext not in previous_extensions]
+        for category, extensions in promoted.items():
+            for ext in extensions:
+                if ext in new_extensions:
+                    self.reporter.logger.info(f'Learned extension .{ext} as {category}.')
+        return new_extensions
+
+
+class DirectoryLease:
+    """
+        Advisory lease on the target directory, so overlapping cron/watch runs don't organize the same files.
+
+        The lease is an fcntl lock on {target_directory}/.porgan.lock. While it is held, a heartbeat thread
+        writes the pid, host and the time of the run's last progress, see report_progress, to the lock file
+        every heartbeat_interval seconds.
+        A run that exits or crashes releases its lock, so it never blocks the next run.
+        A run that hangs keeps its lock: once its last progress is older than stale_after seconds, another run takes over
+        by renaming a new, locked lock file over the old one. The hung run finds out through check() and stops.
+        stale_after must therefore be longer than the slowest single step of a run, e.g. copying a large archive.
+
+        Runs that find the lease held can hand their work to the holder through {target_directory}/.porgan.queue,
+        which the holder runs before it releases the lease.
+
+        parameters:
+            target_directory   (str): The directory to lease.
+            fileIOreporter     (object): An object that handles logging and reporting.
+            heartbeat_interval (float): Seconds between heartbeats.
+            stale_after        (float): Seconds without progress after which the lease is taken over.
+    """
+
+    def __init__(self, target_directory, fileIOreporter, heartbeat_interval = 10, stale_after = 300):
+        self.lock_path = os.path.join(target_directory, LOCK_FILE)
+        self.queue_path = os.path.join(target_directory, QUEUE_FILE)
+        self.takeover_path = os.path.join(target_directory, TAKEOVER_FILE)
+        self.reporter = fileIOreporter
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.fd = None
+        self.held = False
+        self.last_progress = None
+        self._written_progress = None
+        self._stop_heartbeat = threading.Event()
+        self._heartbeat_thread = None
+
+    def acquire(self):
+        """
+        Tries to acquire the lease without waiting, taking it over if the holder's heartbeat is stale.
+
+        parameters: none
+
+        returns: True if the lease is held
+        """
+        if self.held:
+            return True
+        if fcntl is None:
+            self.reporter.logger.warning('Directory locking is not supported on this platform, overlapping runs are not detected.')
+            self.held = True
+            return True
+
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return self._take_over_stale_lease()
+        # the lock file may have been replaced by a takeover between open and flock
+        if not self._is_current_lock_file(fd):
+            os.close(fd)
+            return False
+        self._start(fd)
+        return True
+
+    def wait(self, timeout = None):
+        """
+        Waits until the lease is acquired.
+
+        parameters: timeout (float) - seconds to wait, None waits forever
+
+        returns: True if the lease is held, False on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.acquire():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(min(1, self.heartbeat_interval))
+        return True
+
+    def check(self):
+        """
+        Checks that the lease is still held, i.e. that no other run took it over.
+        Costs one stat, call it before each category rather than each file.
+
+        parameters: none
+
+        returns: True if the lease is held
+        """
+        if not self.held:
+            return False
+        if self.fd is not None and not self._is_current_lock_file(self.fd):
+            self.held = False
+        return self.held
+
+    def report_progress(self):
+        """
+        Records that the run is making progress. Only progress keeps the lease from going stale,
+        so a run whose main thread hangs is taken over even though its heartbeat thread still runs.
+        Cheap enough to call for every file.
+
+        parameters: none
+
+        returns: None
+        """
+        self.last_progress = time.time()
+
+    def release(self):
+        if self._heartbeat_thread is not None:
+            self._stop_heartbeat.set()
+            self._heartbeat_thread.join()
+            self._heartbeat_thread = None
+        if self.fd is not None:
+            # the lock file itself is kept, removing it would race with runs opening it
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+        self.held = False
+
+    def get_holder(self):
+        """
+        Returns the heartbeat of the current holder: a dictionary with its pid, host and time, or None.
+        """
+        try:
+            with open(self.lock_path, 'r') as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def enqueue(self, request):
+        """
+        Hands a run to the holder of the lease.
+        The queue is locked while the lease is checked, so the holder cannot release the lease without seeing the request.
+
+        parameters: request (dict) - the options of the run, see Main.get_request
+
+        returns: True if the request was queued, False if the lease was acquired instead
+        """
+        with self._locked_queue() as queue:
+            if self.acquire():
+                return False
+            queue.seek(0, os.SEEK_END)
+            queue.write(json.dumps(request) + '\n')
+            queue.flush()
+            return True
+
+    def take_queued(self):
+        """
+        Takes the requests queued by other runs. If there are none, the lease is released while the queue is locked,
+        so a run that queues after this call finds the lease free and runs itself.
+
+        parameters: none
+
+        returns: a list of request dictionaries
+        """
+        if fcntl is None or not self.check():
+            return []
+        with self._locked_queue() as queue:
+            queue.seek(0)
+            requests = [json.loads(line) for line in queue.read().splitlines() if line.strip()]
+            queue.seek(0)
+            queue.truncate()
+            if not requests:
+                self.release()
+            return requests
+
+    @contextlib.contextmanager
+    def _locked_queue(self):
+        with open(self.queue_path, 'a+') as queue:
+            fcntl.flock(queue.fileno(), fcntl.LOCK_EX)
+            try:
+                yield queue
+            finally:
+                fcntl.flock(queue.fileno(), fcntl.LOCK_UN)
+
+    def _is_current_lock_file(self, fd):
+        try:
+            path_stat = os.stat(self.lock_path)
+        except FileNotFoundError:
+            return False
+        fd_stat = os.fstat(fd)
+        return (path_stat.st_dev, path_stat.st_ino) == (fd_stat.st_dev, fd_stat.st_ino)
+
+    def _get_heartbeat_age(self):
+        holder = self.get_holder()
+        if holder is not None and 'time' in holder:
+            return time.time() - holder['time']
+        # the holder has not written its first heartbeat yet
+        try:
+            return time.time() - os.path.getmtime(self.lock_path)
+        except OSError:
+            return 0
+
+    def _take_over_stale_lease(self):
+        if self._get_heartbeat_age() < self.stale_after:
+            return False
+        # only one run at a time may take over, the others would replace each other's lock file
+        guard_fd = os.open(self.takeover_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(guard_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            # check again, another run may have taken over before we got the guard
+            if self._get_heartbeat_age() < self.stale_after:
+                return False
+            holder = self.get_holder() or {}
+            temp_path = f'{self.lock_path}.{os.getpid()}'
+            fd = os.open(temp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self._write_heartbeat(fd)
+            os.replace(temp_path, self.lock_path)
+            self.reporter.logger.warning(f'Took over stale lease from pid {holder.get("pid")} on {holder.get("host")}.')
+            self._start(fd)
+            return True
+        finally:
+            fcntl.flock(guard_fd, fcntl.LOCK_UN)
+            os.close(guard_fd)
+
+    def _write_heartbeat(self, fd):
+        progress = self.last_progress
+        heartbeat = json.dumps({'pid': os.getpid(), 'host': socket.gethostname(), 'time': progress}).encode()
+        os.pwrite(fd, heartbeat, 0)
+        os.ftruncate(fd, len(heartbeat))
+        self._written_progress = progress
+
+    def _start(self, fd):
+        self.fd = fd
+        self.held = True
+        self.report_progress()
+        self._write_heartbeat(fd)
+        self._stop_heartbeat.clear()
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self._heartbeat_thread.start()
+
+    def _heartbeat(self):
+        while not self._stop_heartbeat.wait(self.heartbeat_interval):
+            if not self.check():
+                self.reporter.logger.error('Lost the lease on the target directory to another run.')
+                return
+            # without new progress the heartbeat ages, so a hung run goes stale
+            if self.last_progress != self._written_progress:
+                self._write_heartbeat(self.fd)
+
+
+class DestinationIndex:
+    """
+        In-memory index of the file names in a category folder or archive.
+        It is filled from one scandir of the folder or from the zip central directory,
+        so destination conflicts are found without a stat per file.
+        Details of an existing file (mtime, size) are only read when a conflict needs them.
+        Where names are case-insensitive, see CASE_INSENSITIVE_NAMES, names that differ only in case conflict.
+
+        parameters:
+            destination (str): The category folder or archive to index.
+            is_archive  (bool): Whether the destination is a zip archive.
+    """
+
+    def __init__(self, destination, is_archive = False):
+        self.destination = destination
+        self.is_archive = is_archive
+        # key -> ZipInfo, DirEntry, or for files added by this run None in a folder and the source path in an archive
+        self.entries = {}
+        # key -> the name as it is in the destination
+        self.names = {}
+        if is_archive:
+            if os.path.isfile(destination):
+                with zipfile.ZipFile(destination, 'r') as zip:
+                    for info in zip.infolist():
+                        self._set(info.filename, info)
+        elif os.path.isdir(destination):
+            with os.scandir(destination) as entries:
+                for entry in entries:
+                    self._set(entry.name, entry)
+
+    def __contains__(self, name):
+        return self._get_key(name) in self.entries
+
+    def _get_key(self, name):
+        return name.casefold() if CASE_INSENSITIVE_NAMES else name
+
+    def _set(self, name, entry):
+        key = self._get_key(name)
+        self.entries[key] = entry
+        self.names[key] = name
+
+    def add(self, name, file = None):
+        """
+        Adds a file written by this run to the index.
+
+        parameters: name (str) - the file name in the destination
+                    file (str) - the source file, needed for archives as the file is not in the archive yet
+
+        returns: None
+        """
+        self._set(name, file if self.is_archive else None)
+
+    def get_existing_name(self, name):
+        """
+        Returns the name of the indexed file that conflicts with a name, which may differ in case.
+
+        parameters: name (str) - a file name in the index
+
+        returns: the name as it is in the destination
+        """
+        return self.names[self._get_key(name)]
+
+    def get_free_name(self, name):
+        """
+        Returns the first name_n.ext that is not in the index.
+
+        parameters: name (str) - the conflicting file name
+
+        returns: a file name that does not conflict
+        """
+        stem, ext = os.path.splitext(name)
+        n = 1
+        while f'{stem}_{n}{ext}' in self:
+            n += 1
+        return f'{stem}_{n}{ext}'
+
+    def get_mtime(self, name):
+        entry = self.entries[self._get_key(name)]
+        if isinstance(entry, zipfile.ZipInfo):
+            return time.mktime(entry.date_time + (0, 0, -1))
+        if isinstance(entry, os.DirEntry):
+            return entry.stat().st_mtime
+        return os.path.getmtime(self._get_path(name))
+
+    def get_mtime_resolution(self, name):
+        """
+        Returns how far the mtime of an indexed file may be behind the mtime of the file it was written from.
+
+        parameters: name (str) - the indexed file name
+
+        returns: the resolution in seconds, 0 unless the file is an archived entry
+        """
+        return ZIP_MTIME_RESOLUTION if isinstance(self.entries[self._get_key(name)], zipfile.ZipInfo) else 0
+
+    def get_size(self, name):
+        entry = self.entries[self._get_key(name)]
+        if isinstance(entry, zipfile.ZipInfo):
+            return entry.file_size
+        if isinstance(entry, os.DirEntry):
+            return entry.stat().st_size
+        return os.path.getsize(self._get_path(name))
+
+    def _get_path(self, name):
+        # files added by this run are in the folder, or still at their source path when archived
+        entry = self.entries[self._get_key(name)]
+        return entry if isinstance(entry, str) else os.path.join(self.destination, self.get_existing_name(name))
+
+    def has_same_content(self, name, file):
+        """
+        Checks if the indexed file has the same content as the given file.
+        Sizes are compared first, archived files are compared by CRC32 so the archive is not read.
+
+        parameters: name (str) - the indexed file name
+                    file (str) - the path of the file to compare with
+
+        returns: True if the content is the same
+        """
+        if os.path.getsize(file) != self.get_size(name):
+            return False
+        entry = self.entries[self._get_key(name)]
+        if isinstance(entry, zipfile.ZipInfo):
+            crc = 0
+            with open(file, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    crc = zlib.crc32(chunk, crc)
+            return crc == entry.CRC
+        return filecmp.cmp(file, self._get_path(name), shallow=False)
+
+
 class FileOrganizer:
     """
         uses the data from self.data_fetcher to organize the files
@@ -257,9 +1218,20 @@ class FileOrganizer:
             archive               (bool): Whether or not to archive files.
             move                  (bool): Whether or not to move files.
             remove_duplicates     (bool): Whether or not to remove duplicate files.
+            conflict_policy       (str): What to do when a file already exists in the destination, one of CONFLICT_POLICIES.
+                if None, the conflict policy from the settings file will be used
+            durability            (str): How moved/archived files are flushed to disk, one of DURABILITY_LEVELS.
+                none:    no fsync, archives are appended in place
+                batched: destination files and folders are fsynced once per durability_batch_size files and per category,
+                         archives are written to a temp file and atomically renamed into place before originals are removed
+                strict:  every moved file is fsynced with its folders before the next one,
+                         new archive entries are read back and checked before the archive is renamed into place
+                if None, the durability level from the settings file will be used
+            lease                 (DirectoryLease): The lease on the target directory, checked before each category.
+                if None, the lease is not checked
     """
     
-    def __init__(self, fileIOreporter, data_fetcher, archive = False, move = False, remove_duplicates = False):
+    def __init__(self, fileIOreporter, data_fetcher, archive = False, move = False, remove_duplicates = False, conflict_policy = None, durability = None, lease = None):
         
         self.fetcher = data_fetcher
         self.target_directory = self.fetcher.new_target_directory
@@ -270,6 +1242,74 @@ class FileOrganizer:
         self._move_files = move
         self._remove_duplicates = remove_duplicates
         self.reporter = fileIOreporter
+        self.conflict_policy = conflict_policy or self.fetcher.settings.get('conflict_policy', 'rename')
+        if self.conflict_policy not in CONFLICT_POLICIES:
+            self.reporter.logger.error(f'Unknown conflict policy: {self.conflict_policy}. Using rename.')
+            self.conflict_policy = 'rename'
+        self.conflicts = {'skipped': 0, 'renamed': 0, 'replaced': 0, 'redundant': 0}
+        self.durability = durability or self.fetcher.settings.get('durability', 'none')
+        if self.durability not in DURABILITY_LEVELS:
+            self.reporter.logger.error(f'Unknown durability level: {self.durability}. Using strict.')
+            self.durability = 'strict'
+        self.durability_batch_size = self.fetcher.settings.get('durability_batch_size', 100)
+        self.lease = lease
+
+    #check that no other run took over the target directory
+    def has_lease(self):
+        self.report_progress()
+        if self.lease is None or self.lease.check():
+            return True
+        self.reporter.logger.error('Lost the lease on the target directory to another run. Stopping...')
+        return False
+
+    def report_progress(self):
+        if self.lease is not None:
+            self.lease.report_progress()
+
+    @staticmethod
+    def is_process_running(pid):
+        """
+        Checks if a process with the given pid is running on this host.
+
+        parameters: pid (int) - the process id
+
+        returns: True if the process is running, or if that cannot be checked
+        """
+        if os.name == 'nt':
+            # os.kill terminates the process on Windows
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def remove_stale_temp_archives(self):
+        """
+        Removes the {category}.zip.{pid}.tmp temp archives left by runs that crashed while writing an archive.
+        Temp archives of runs that are still running are kept, with a warning. Call it while holding the lease.
+
+        parameters: none
+
+        returns: None
+        """
+        app_made_zips = set(self.fetcher.get_app_made_zips())
+        with os.scandir(self.target_directory) as entries:
+            names = [entry.name for entry in entries if entry.name.endswith('.tmp') and '.zip.' in entry.name]
+        for name in names:
+            archive, _, pid = name[:-len('.tmp')].rpartition('.')
+            if archive not in app_made_zips or not pid.isdigit():
+                continue
+            if self.is_process_running(int(pid)):
+                self.reporter.logger.warning(f'Temp archive {name} belongs to running process {pid}, keeping it.')
+                continue
+            self.reporter.logger.warning(f'Removing temp archive {name} left by a run that did not finish.')
+            try:
+                os.remove(os.path.join(self.target_directory, name))
+            except OSError as e:
+                self.reporter.logger.error(f'Failed to remove {name}: {e}')
 
     #create folders for each key in file_dict
     def create_folders(self, file_dict):
@@ -301,8 +1341,11 @@ class FileOrganizer:
         for key in file_dict.keys():
             # check if archive exists
             if not os.path.exists(f'{self.target_directory}/{key}.zip'):
-                # if not, create archive
-                shutil.make_archive(f'{self.target_directory}/{key}', 'zip', f'{self.target_directory}/{key}')
+                # if not, create archive from the category folder, or an empty archive if there is no folder
+                if os.path.isdir(f'{self.target_directory}/{key}'):
+                    shutil.make_archive(f'{self.target_directory}/{key}', 'zip', f'{self.target_directory}/{key}')
+                else:
+                    zipfile.ZipFile(f'{self.target_directory}/{key}.zip', 'w').close()
                 
                 archives_created.append(f'{key}.zip')
                 
@@ -332,7 +1375,8 @@ class FileOrganizer:
 
         #get list of duplicate files and orphaned duplicates
         #duplicates, orphans(tuple(file, pattern))
-        duplicates, orphaned_duplicates = self.fetcher.get_duplicate_files(self.fetcher.file_list)
+        with self.reporter.profiler.span('get_duplicate_files'):
+            duplicates, orphaned_duplicates = self.fetcher.get_duplicates()
 
         files_removed = 0
         files_renamed = 0
@@ -353,7 +1397,9 @@ class FileOrganizer:
             if self.fetcher.settings['rename_orphaned_duplicates'] == True and len(orphaned_duplicates) > 0:
                 self.reporter.logger.info(f'Renaming {len(orphaned_duplicates)} orphaned duplicate files...')
                 #self.rename_orphaned_duplicates(orphaned_duplicates)
+                renamed_files = []
                 for file, pattern in orphaned_duplicates:
+                    self.report_progress()
                     #safely rename orphaned duplicate
                     if os.path.isfile(file):
                         new_filename = self.fetcher.strip_duplicate_pattern(file, pattern)
@@ -367,7 +1413,11 @@ class FileOrganizer:
                             continue
 
                         files_renamed += 1
+                        renamed_files.append((file, new_filename))
 
+                #keep the manifest in sync with the renamed files
+                self.fetcher.forget_files([file for file, new_filename in renamed_files])
+                self.fetcher.add_files([new_filename for file, new_filename in renamed_files])
                 self.reporter.logger.info(f'{files_renamed} files renamed.')
             
             #if setting['delete_duplicate_files] there are duplicate files to remove
@@ -375,7 +1425,9 @@ class FileOrganizer:
                 #print duplicate removal status
                 self.reporter.logger.info (f"Removing {len(duplicates)} duplicate files...")
 
+                removed_files = []
                 for file in duplicates:
+                    self.report_progress()
                     #safely remove duplicate
                     if os.path.isfile(file):
                         #print file being removed
@@ -387,10 +1439,198 @@ class FileOrganizer:
                             self.reporter.logger.error(f'Failed to remove {os.path.basename(file)}')
                             continue
                         files_removed += 1
+                        removed_files.append(file)
         
+                self.fetcher.forget_files(removed_files)
                 self.reporter.logger.info(f'{files_removed} files removed.\n')
         return all_duplicates_removed and all_orphans_renamed
     
+    #decide what to do with a file whose name may already exist in the destination
+    def resolve_conflict(self, file, index):
+        """
+        Applies the conflict policy to a file that is about to be moved or archived.
+
+        parameters: file (str) - the file to move or archive
+                    index (DestinationIndex) - the index of the destination folder or archive
+
+        returns: tuple(str, str) - the action and the destination file name. The action is one of
+            'write' (no conflict, or renamed), 'replace' (overwrite the existing file),
+            'skip' (leave the file in place) or 'redundant' (the existing file is kept, the file is not needed)
+        """
+        name = os.path.basename(file)
+        if name not in index:
+            return 'write', name
+
+        if self.conflict_policy == 'rename':
+            self.conflicts['renamed'] += 1
+            return 'write', index.get_free_name(name)
+        if self.conflict_policy == 'keep_newer':
+            # equal times are not newer, and archived times are rounded down to their resolution
+            if os.path.getmtime(file) > index.get_mtime(name) + index.get_mtime_resolution(name):
+                self.conflicts['replaced'] += 1
+                return 'replace', name
+            self.conflicts['redundant'] += 1
+            return 'redundant', name
+        if self.conflict_policy == 'replace_if_different':
+            if index.has_same_content(name, file):
+                self.conflicts['redundant'] += 1
+                return 'redundant', name
+            self.conflicts['replaced'] += 1
+            return 'replace', name
+
+        self.conflicts['skipped'] += 1
+        return 'skip', name
+
+    #remove a file that already exists in its destination, if enabled in settings
+    def remove_redundant_file(self, file, destination):
+        file_no_path = os.path.basename(file)
+        if self.fetcher.settings.get('delete_redundant_files', False):
+            self.reporter.logger.debug(f'\t{file_no_path} already exists in {destination}. Removing...')
+            os.remove(file)
+            return True
+        self.reporter.logger.debug(f'\t{file_no_path} already exists in {destination}. Skipping...')
+        return False
+
+    #copy an archive without the given names, zip files cannot remove entries in place
+    def copy_archive(self, archive, destination, skipped_names = ()):
+        if not skipped_names:
+            shutil.copyfile(archive, destination)
+            return
+        with zipfile.ZipFile(archive, 'r') as source:
+            infos = sorted(source.infolist(), key=lambda info: info.header_offset)
+            # the local header, data and data descriptor of an entry end where the next entry or the central directory starts
+            ends = [info.header_offset for info in infos[1:]] + [source.start_dir]
+        #kept entries are copied byte for byte, so they are not decompressed and compressed again
+        with open(archive, 'rb') as source_file, zipfile.ZipFile(destination, 'w') as copy:
+            for info, end in zip(infos, ends):
+                if info.filename in skipped_names:
+                    continue
+                self.report_progress()
+                remaining = end - info.header_offset
+                if remaining < info.compress_size:
+                    raise zipfile.BadZipFile(f'Overlapping entries in {os.path.basename(archive)}')
+                source_file.seek(info.header_offset)
+                info.header_offset = copy.fp.tell()
+                while remaining:
+                    chunk = source_file.read(min(remaining, 1024 * 1024))
+                    if not chunk:
+                        raise zipfile.BadZipFile(f'{os.path.basename(archive)} is truncated')
+                    copy.fp.write(chunk)
+                    remaining -= len(chunk)
+                copy.filelist.append(info)
+                copy.NameToInfo[info.filename] = info
+            # the central directory is written after the copied entries when the copy is closed
+            copy.start_dir = copy.fp.tell()
+
+    #flush files and folders to disk
+    def sync_to_disk(self, files = (), folders = ()):
+        with self.reporter.profiler.file_span('fsync', files=len(files), folders=len(folders)):
+            for file in files:
+                fd = os.open(file, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            # folders cannot be opened for fsync on Windows
+            if os.name == 'nt':
+                return
+            for folder in folders:
+                fd = os.open(folder, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+
+    #move a file so the original is only removed once the destination is on disk
+    def move_file_strict(self, file, destination):
+        try:
+            os.replace(file, destination)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # different file systems, copy and sync before removing the original
+            shutil.copy2(file, destination)
+            self.sync_to_disk([destination], [os.path.dirname(destination)])
+            os.remove(file)
+        self.sync_to_disk([destination], [os.path.dirname(destination), os.path.dirname(file)])
+        return destination
+
+    #write files to an archive, returns the files that were archived
+    def write_archive(self, archive, files_to_archive, replaced_names):
+        """
+        Writes files to an archive.
+        With durability none the archive is appended in place. Otherwise the archive is copied to a temp file,
+        the files are appended to the copy, and the copy is fsynced and atomically renamed over the archive,
+        so a crash leaves either the old or the new archive, never one without a central directory.
+        Replacing archived files always goes through a temp file, as zip entries cannot be removed in place.
+
+        parameters: archive (str) - the path of the archive
+                    files_to_archive (list<tuple>) - the files to archive and their names in the archive
+                    replaced_names (set) - archived names to replace
+
+        returns: a list of the files that were archived. The originals are not removed.
+        """
+        archived_files = []
+        use_temp_archive = self.durability != 'none' or replaced_names
+        # each run has its own temp file, a run that lost the lease must not write into the new holder's copy
+        archive_path = f'{archive}.{os.getpid()}.tmp' if use_temp_archive else archive
+        created_temp_archive = False
+        profiler = self.reporter.profiler
+
+        try:
+            if use_temp_archive:
+                os.close(os.open(archive_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+                created_temp_archive = True
+                with profiler.span('copy_archive', 'category', skipped=len(replaced_names)):
+                    self.copy_archive(archive, archive_path, replaced_names)
+
+            #TODO add error handling
+            with zipfile.ZipFile(archive_path, 'a') as zip:
+                for file, arcname in files_to_archive:
+                    self.report_progress()
+                    file_no_path = os.path.basename(file)
+                    self.reporter.logger.debug(f'\tArchiving {file_no_path}...')
+                    #remove absolute path from filename before zipping
+                    with profiler.file_span('zip write', file=file_no_path):
+                        zip.write(f'{file}', arcname=arcname)
+                    
+                    #check if file was added to archive
+                    if arcname in zip.NameToInfo:
+                        self.reporter.logger.debug(f'\t{file_no_path} archived successfully.')
+                        archived_files.append(file)
+                    #if file was not added to archive
+                    else:
+                        self.reporter.logger.error(f'\t{file_no_path} failed to archive.')
+
+            if use_temp_archive:
+                if self.durability == 'strict':
+                    #read back the new entries, reading checks their CRC
+                    with profiler.span('verify_archive', 'category', files=len(archived_files)):
+                        archived = set(archived_files)
+                        with zipfile.ZipFile(archive_path, 'r') as zip:
+                            for file, arcname in files_to_archive:
+                                if file not in archived:
+                                    continue
+                                with zip.open(arcname) as archived_file:
+                                    while archived_file.read(1024 * 1024):
+                                        pass
+                self.report_progress()
+                if self.durability != 'none':
+                    self.sync_to_disk([archive_path])
+                # another run that took over the lease may be writing the archive now, keep the originals
+                if not self.has_lease():
+                    os.remove(archive_path)
+                    return []
+                os.replace(archive_path, archive)
+                if self.durability != 'none':
+                    self.sync_to_disk(folders=[os.path.dirname(os.path.abspath(archive))])
+        except Exception:
+            # leave the archive as it was, the originals are kept
+            if created_temp_archive and os.path.exists(archive_path):
+                os.remove(archive_path)
+            raise
+        return archived_files
+
     #move files into folders
     def move_files(self, file_dict):
 
@@ -404,27 +1644,69 @@ class FileOrganizer:
         self.reporter.logger.info(f'Moving {file_count} files...')
 
         action_count = 0
+        moved_files = []
+        profiler = self.reporter.profiler
+        #destination files not yet fsynced, for batched durability
+        unsynced_files = []
 
         for file_category, file_list in file_dict.items():
-            self.reporter.logger.debug(f'Moving {len(file_list)} file(s) to {file_category}...')
-            for file in file_list:
-                #check if file exists
-                if os.path.exists(f'{file}'):
-                    #TODO add more robust error handling
+            if not self.has_lease():
+                all_files_moved = False
+                break
+            with profiler.span(file_category, 'category', files=len(file_list)):
+                self.reporter.logger.debug(f'Moving {len(file_list)} file(s) to {file_category}...')
+                #index the names in the category folder once, instead of checking every destination
+                index = DestinationIndex(f'{self.target_directory}/{file_category}')
+                for file in file_list:
+                    self.report_progress()
+                    #check if file exists
+                    if os.path.exists(f'{file}'):
+                        #TODO add more robust error handling
                     
-                    file_no_path = os.path.basename(file)
+                        #strip filepath from filename
+                        file_no_path = os.path.basename(file)
+
+                        action, destination_name = self.resolve_conflict(file, index)
+                        if action == 'skip':
+                            self.reporter.logger.debug(f'\t{file_no_path} already exists in {file_category}. Skipping...')
+                            continue
+                        if action == 'redundant':
+                            if self.remove_redundant_file(file, file_category):
+                                moved_files.append(file)
+                            continue
 
-                    self.reporter.logger.debug(f'\tMoving {file_no_path}...')
-                    #strip filepath from filename
+                        self.reporter.logger.debug(f'\tMoving {file_no_path}...')
+                        if file_category == 'unknowns':
+                            #record before the move, the content is sniffed from the file
+                            self.fetcher.extension_registry.record([file])
                     
-                     #TODO replace this with try/except
-                    if shutil.move(f'{file}', f'{self.target_directory}/{file_category}/{file_no_path}'):
-                        self.reporter.logger.debug(f'\t{file_no_path} moved successfully.')
-                    action_count += 1
-                else:
-                    self.reporter.logger.error(f'\t{file} does not exist, skipping...')
-                    all_files_moved = False
+                         #TODO replace this with try/except
+                        destination = f'{self.target_directory}/{file_category}/{destination_name}'
+                        with profiler.file_span('move', file=file_no_path):
+                            if self.durability == 'strict':
+                                moved = self.move_file_strict(f'{file}', destination)
+                            else:
+                                moved = shutil.move(f'{file}', destination)
+                        if moved:
+                            self.reporter.logger.debug(f'\t{file_no_path} moved successfully.')
+                        index.add(destination_name)
+                        action_count += 1
+                        moved_files.append(file)
+
+                        if self.durability == 'batched':
+                            unsynced_files.append(destination)
+                            if len(unsynced_files) >= self.durability_batch_size:
+                                self.sync_to_disk(unsynced_files, [f'{self.target_directory}/{file_category}', self.target_directory])
+                                unsynced_files = []
+                    else:
+                        self.reporter.logger.error(f'\t{file} does not exist, skipping...')
+                        all_files_moved = False
+
+                if unsynced_files:
+                    self.sync_to_disk(unsynced_files, [f'{self.target_directory}/{file_category}', self.target_directory])
+                    unsynced_files = []
         
+        self.fetcher.forget_files(moved_files)
         self.reporter.logger.info(f'{action_count} files moved.')
         self.reporter.logger.debug(f'All files moved: {all_files_moved}')
         
@@ -442,44 +1724,80 @@ class FileOrganizer:
         self.reporter.logger.info(f'Archiving {file_count} files...')
         
         action_count = 0    
+        archived_files = []
+        profiler = self.reporter.profiler
         
         for file_category, file_list in file_dict.items():
-
-            self.reporter.logger.debug(f'Archiving {len(file_list)} file(s) to {file_category}.zip...')
-            for file in file_list:
-                if os.path.exists(f'{file}'):
+            if not self.has_lease():
+                all_files_archived = False
+                break
+            with profiler.span(file_category, 'category', files=len(file_list)):
+
+                self.reporter.logger.debug(f'Archiving {len(file_list)} file(s) to {file_category}.zip...')
+                archive = f'{self.target_directory}/{file_category}.zip'
+                #index the names in the archive once from its central directory
+                try:
+                    index = DestinationIndex(archive, is_archive=True)
+                except (OSError, zipfile.BadZipFile) as e:
+                    self.reporter.logger.error(f'\tFailed to read {file_category}.zip: {e}')
+                    all_files_archived = False
+                    continue
+                #files to write as (file, arcname), and archived files to replace
+                files_to_archive = []
+                replaced_names = set()
+
+                for file in file_list:
+                    self.report_progress()
+                    if os.path.exists(f'{file}'):
                     
-                    file_no_path = os.path.basename(file)
+                        file_no_path = os.path.basename(file)
 
-                    #TODO add error handling
-                    self.reporter.logger.debug(f'\tArchiving {file_no_path}...')
-                    # check if file is already present in archive
-                    with zipfile.ZipFile(f'{self.target_directory}/{file_category}.zip', 'a') as zip:
-                        
-                        if file in zip.namelist():
-                            #TODO add prompt or setting to overwrite existing files
+                        # check if file is already present in archive
+                        action, arcname = self.resolve_conflict(file, index)
+                        if action == 'skip':
                             self.reporter.logger.info(f'\t{file_no_path} already exists in {file_category}.zip. Skipping...')
                             continue
+                        if action == 'redundant':
+                            if self.remove_redundant_file(file, f'{file_category}.zip'):
+                                archived_files.append(file)
+                            continue
+                        if action == 'replace':
+                            #the archived name may differ in case
+                            replaced_names.add(index.get_existing_name(arcname))
 
-                        else:
-                            #remove absolute path from filename before zipping
-                            zip.write(f'{file}', arcname=file_no_path)
-                            
-                            #check if file was added to archive
-                            if file_no_path in zip.namelist():
-                                self.reporter.logger.debug(f'\t{file_no_path} archived successfully.')
-                            #if file was not added to archive
-                            else:
-                                self.reporter.logger.error(f'\t{file_no_path} failed to archive.')
-                                all_files_archived = False
-                                continue
-                            #remove original file
-                            os.remove(f'{file}')
-                            action_count += 1
-                        zip.close()
-                else:
-                    self.reporter.logger.error(f'\t{file} does not exist, skipping...')
+                        index.add(arcname, file)
+                        files_to_archive.append((file, arcname))
+                    else:
+                        self.reporter.logger.error(f'\t{file} does not exist, skipping...')
+                        all_files_archived = False
+
+                if not files_to_archive:
+                    continue
+                if replaced_names:
+                    self.reporter.logger.debug(f'\tReplacing {len(replaced_names)} file(s) in {file_category}.zip...')
+
+                try:
+                    archived_in_category = self.write_archive(archive, files_to_archive, replaced_names)
+                except (OSError, zipfile.BadZipFile) as e:
+                    # e.g. no space for the temp archive, the originals are kept and the next category is tried
+                    self.reporter.logger.error(f'\tFailed to archive to {file_category}.zip: {e}')
                     all_files_archived = False
+                    continue
+                if len(archived_in_category) != len(files_to_archive):
+                    all_files_archived = False
+
+                if file_category == 'unknowns':
+                    self.fetcher.extension_registry.record(archived_in_category)
+                #remove original files once the archive is closed
+                for file in archived_in_category:
+                    self.report_progress()
+                    with profiler.file_span('remove', file=os.path.basename(file)):
+                        os.remove(f'{file}')
+                    action_count += 1
+                    archived_files.append(file)
+                if archived_in_category and self.durability != 'none':
+                    self.sync_to_disk(folders=[self.target_directory])
+        self.fetcher.forget_files(archived_files)
         self.reporter.logger.info(f'{action_count} files archived.')
         self.reporter.logger.debug(f'all_files_archived: {all_files_archived}')
         return all_files_archived
@@ -496,14 +1814,32 @@ class FileOrganizer:
         files_archived_success = True
         files_moved_sucess = True
         
+        profiler = self.reporter.profiler
+
+        # a run that crashed did not save its manifest, so the scan after it is never skipped
+        if (self._archive_files or self._move_files) and not self.fetcher.scan_skipped:
+            with profiler.span('remove_stale_temp_archives'):
+                self.remove_stale_temp_archives()
+
         if self._remove_duplicates:
-            duplicates_removed_success = self.remove_duplicates_files()
+            with profiler.span('remove_duplicates'):
+                duplicates_removed_success = self.has_lease() and self.remove_duplicates_files()
         
         if self._archive_files:
-            files_archived_success = self.archive_files(self.fetcher.create_file_dictionary(self.fetcher.get_file_list()))
+            with profiler.span('classify'):
+                file_dict = self.fetcher.get_file_dictionary()
+            with profiler.span('archive_files'):
+                files_archived_success = self.archive_files(file_dict)
         elif self._move_files:
-            files_moved_sucess = self.move_files(self.fetcher.create_file_dictionary(self.fetcher.get_file_list()))
+            with profiler.span('classify'):
+                file_dict = self.fetcher.get_file_dictionary()
+            with profiler.span('move_files'):
+                files_moved_sucess = self.move_files(file_dict)
         
+        if self._archive_files or self._move_files:
+            self.reporter.logger.info(f'Conflicts ({self.conflict_policy}): {self.conflicts["skipped"]} skipped, {self.conflicts["renamed"]} renamed, '
+                                      f'{self.conflicts["replaced"]} replaced, {self.conflicts["redundant"]} already present.')
+
         self.reporter.logger.debug(f'duplicates_removed_success: {duplicates_removed_success}')
         self.reporter.logger.debug(f'files_archived_success: {files_archived_success}')
         self.reporter.logger.debug(f'files_moved_sucess: {files_moved_sucess}')
@@ -512,6 +1848,7 @@ class FileOrganizer:
         return {"duplicate_files_removed": duplicates_removed_success,
                 "files_archived": files_archived_success,
                 "files_moved_success": files_moved_sucess,
+                "conflicts": self.conflicts,
                 "all": duplicates_removed_success and files_archived_success and files_moved_sucess}
 
 
@@ -550,7 +1887,7 @@ class FileIOReporter:
     """
                                          
     
-    def __init__(self, target_directory, move_mode, archive_mode, remove_duplicates_mode, log_level=logging.INFO, data_fetcher=None):
+    def __init__(self, target_directory, move_mode, archive_mode, remove_duplicates_mode, log_level=logging.INFO, data_fetcher=None, profiler=None):
         # CLI args...
         self._dry_move = move_mode
         self._dry_archive = archive_mode
@@ -568,6 +1905,9 @@ class FileIOReporter:
         # data fetcher setup
         self.fetcher = data_fetcher
 
+        # profiling setup, disabled unless --profile is passed
+        self.profiler = profiler if profiler is not None else RunProfiler()
+
     # simulate moving files
     def dry_move(self, file_dict):
         # TODO test
@@ -590,6 +1930,7 @@ class FileIOReporter:
         for file_category, file_list in file_dict.items():
         
             self.logger.info(f'Moving {len(file_list)} file(s) to {file_category}...')
+            index = DestinationIndex(f'{target_directory}/{file_category}')
             for file in file_list:
                 file_no_path = os.path.basename(file)
 
@@ -601,7 +1942,8 @@ class FileIOReporter:
                     self.logger.info(f'\tMoving {file_no_path}...')
 
                     # check if file is already present in target directory
-                    #TODO remove this check
+                    if file_no_path in index:
+                        self.logger.info(f'\t{file_no_path} already exists in {file_category}, the conflict policy applies.')
                     self.logger.info(f'\tMoved {file_no_path} to {file_category}.')
                     action_count += 1
                 else:
@@ -633,30 +1975,22 @@ class FileIOReporter:
 
         for file_category, file_list in file_dict.items():
             self.logger.info(f'Archiving {len(file_list)} file(s) to {file_category}.zip...')
+            #index the archive once per category instead of opening it for every file
+            index = DestinationIndex(f'{target_directory}/{file_category}.zip', is_archive=True)
             for file in file_list:
                 file_no_path = os.path.basename(file)
                 #ensure file still exists
                 if os.path.exists(f'{file}'):
                     self.logger.info(f'\tArchiving {file_no_path}...')
                     
-                    #check if zip file exists
-                    if os.path.exists(f'{target_directory}/{file_category}.zip'):
                     # check if file is already present in archive
-                        with zipfile.ZipFile(f'{target_directory}/{file_category}.zip', 'r') as zip:
-                            if file_no_path in zip.namelist():
-                                print(f'\t{file_no_path} already exists in {file_category}.zip. Skipping...')
-                                all_files_archived = False
-                                zip.close()
-                                continue
-                            else:
-                                self.logger.info(f'\tArchived {file_no_path} to {file_category}.zip.')
-                                self.logger.info(f'\tRemoved original file: {file_no_path}.')
-                                action_count += 1
-                                zip.close()
-                    else:
-                        self.logger.info(f'\tArchived {file_no_path} to {file_category}.zip.')
-                        self.logger.info(f'\tRemoved original file: {file_no_path}.')
-                        action_count += 1
+                    if file_no_path in index:
+                        self.logger.info(f'\t{file_no_path} already exists in {file_category}.zip, the conflict policy applies.')
+                        all_files_archived = False
+                        continue
+                    self.logger.info(f'\tArchived {file_no_path} to {file_category}.zip.')
+                    self.logger.info(f'\tRemoved original file: {file_no_path}.')
+                    action_count += 1
                 else:
                     self.logger.error(f'\t{file} does not exist, skipping...')
                     all_files_archived = False
@@ -669,7 +2003,7 @@ class FileIOReporter:
     def dry_remove_duplicates(self):
         #TODO test
         prefix = "Dry run: "
-        duplicates, orphaned_duplicates = self.fetcher.get_duplicate_files(self.fetcher.file_list)#type: ignore
+        duplicates, orphaned_duplicates = self.fetcher.get_duplicates()#type: ignore
         
         files_removed = 0
 
@@ -707,14 +2041,111 @@ class FileIOReporter:
         #TODO make messaging more consistent
 
         if self._dry_remove_duplicates:
-            self.dry_remove_duplicates()
+            with self.profiler.span('dry_remove_duplicates'):
+                self.dry_remove_duplicates()
         if self._dry_archive:
-            self.dry_archive(self.fetcher.create_file_dictionary(self.fetcher.get_file_list()))#type: ignore
+            with self.profiler.span('dry_archive'):
+                self.dry_archive(self.fetcher.get_file_dictionary())#type: ignore
         elif self._dry_move:
-            self.dry_move(self.fetcher.create_file_dictionary(self.fetcher.get_file_list()))#type: ignore
+            with self.profiler.span('dry_move'):
+                self.dry_move(self.fetcher.get_file_dictionary())#type: ignore
         pass
     
 
+class RunProfiler:
+    """
+    records where the time of a run goes, enabled with --profile
+
+    writes two files:
+        - {output_prefix}.pstats: cProfile stats of the whole run, read with python -m pstats
+        - {output_prefix}.trace.json: spans of each stage, each category and slow file operations
+          in Chrome trace-event format, open in chrome://tracing or https://ui.perfetto.dev
+
+    when disabled, span() and file_span() return a shared no-op context manager,
+    so instrumented code only costs a method call
+
+    parameters:
+        output_prefix     (str): path prefix of the output files. If None, profiling is disabled.
+        file_threshold_ms (float): file operations faster than this are left out of the trace
+    """
+
+    def __init__(self, output_prefix = None, file_threshold_ms = 10):
+        self.enabled = output_prefix is not None
+        self.output_prefix = output_prefix
+        self.file_threshold_ns = int(file_threshold_ms * 1_000_000)
+        self.events = []
+        self.profile = None
+        self.start_ns = 0
+        self.pid = os.getpid()
+        self.null_span = contextlib.nullcontext()
+
+    def start(self):
+        if not self.enabled:
+            return
+        self.start_ns = time.perf_counter_ns()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def span(self, name, category = 'stage', **args):
+        """
+        Returns a context manager that records a span in the trace.
+
+        parameters: name (str) - the name of the span
+                    category (str) - the trace category, e.g. stage, category or file
+                    args - extra values shown with the span
+
+        returns: a context manager
+        """
+        if not self.enabled:
+            return self.null_span
+        return self._record(name, category, 0, args)
+
+    def file_span(self, name, **args):
+        """
+        Like span(), but the span is only recorded if it takes longer than file_threshold_ms.
+        """
+        if not self.enabled:
+            return self.null_span
+        return self._record(name, 'file', self.file_threshold_ns, args)
+
+    @contextlib.contextmanager
+    def _record(self, name, category, threshold_ns, args):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter_ns() - start
+            if duration >= threshold_ns:
+                self.events.append({'name': name, 'cat': category, 'ph': 'X',
+                                    'ts': (start - self.start_ns) / 1000, 'dur': duration / 1000,
+                                    'pid': self.pid, 'tid': threading.get_ident(), 'args': args})
+
+    def stop(self):
+        """
+        Stops profiling and writes the pstats and trace files.
+
+        parameters: none
+
+        returns: a list of the files written
+        """
+        if not self.enabled or self.profile is None:
+            return []
+        self.profile.disable()
+        stats_path = f'{self.output_prefix}.pstats'
+        trace_path = f'{self.output_prefix}.trace.json'
+        self.profile.dump_stats(stats_path)
+        with open(trace_path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+        self.profile = None
+        return [stats_path, trace_path]
+
+    def get_summary(self, count = 15):
+        # top functions by cumulative time, for the verbose log
+        stream = io.StringIO()
+        pstats.Stats(f'{self.output_prefix}.pstats', stream=stream).sort_stats('cumulative').print_stats(count)
+        return stream.getvalue()
+
+
 class Main:
     """
     gets arguments from command line
@@ -735,44 +2166,161 @@ class Main:
         parser.add_argument('--dry-run', action='store_true', help='Simulate running the program without actually moving/removing files')
         parser.add_argument('-v', '--verbose', action='store_true', help='Displays verbose output')
         parser.add_argument('-t', '--target', type=str, help=f'Target directory to organize. Default is /home/user/Downloads')
+        parser.add_argument('-c', '--conflict-policy', choices=CONFLICT_POLICIES, help='What to do when a file already exists in its destination. Default is set in Settings.yaml')
+        parser.add_argument('--durability', choices=DURABILITY_LEVELS, help='How moved/archived files are flushed to disk. Default is set in Settings.yaml')
+        parser.add_argument('--if-locked', choices=LEASE_CONTENTION_MODES, help='What to do when another run is organizing the target directory: exit, wait for it, or queue this run for it. Default is set in Settings.yaml')
+        parser.add_argument('--full-scan', action='store_true', help='Ignore the manifest of the previous run and scan the whole target directory')
+        parser.add_argument('--profile', nargs='?', const=time.strftime('porgan-profile-%Y%m%d-%H%M%S'), metavar='PREFIX', help='Write cProfile stats and a Chrome trace of the run to PREFIX.pstats and PREFIX.trace.json')
+        parser.add_argument('--profile-threshold', type=float, default=10, metavar='MS', help='Only trace file operations slower than MS milliseconds. Default is 10')
         self.args = parser.parse_args()
 
     def run(self):
 
+        profiler = RunProfiler(self.args.profile, self.args.profile_threshold)
+        profiler.start()
+        try:
+            self._run(profiler)
+        finally:
+            for path in profiler.stop():
+                logging.getLogger("system_logger").info(f'Profile written to {path}')
+            if profiler.enabled:
+                logging.getLogger("system_logger").debug(profiler.get_summary())
+
+    def _run(self, profiler):
+
         reporter = FileIOReporter(self.args.target, 
                                   move_mode=self.args.move, 
                                   archive_mode=self.args.archive, 
                                   remove_duplicates_mode=self.args.rm_duplicates, 
-                                  log_level = logging.DEBUG if self.args.verbose else logging.INFO)
+                                  log_level = logging.DEBUG if self.args.verbose else logging.INFO,
+                                  profiler = profiler)
+        # the target directory is only scanned once this run holds the lease on it
         fetcher = DataFetcher( fileIOreporter = reporter, 
                                settings_file = './Settings.yaml', 
                                path_to_extensions_file = './Extensions.yaml', 
-                               target_directory = self.args.target)
+                               target_directory = self.args.target,
+                               full_scan = self.args.full_scan,
+                               scan_on_init = False)
         reporter.fetcher = fetcher
 
 
         reporter.logger.info("Starting...\n")
 
-        organizer = FileOrganizer( fileIOreporter = reporter,
-                                   data_fetcher= fetcher,
-                                   archive = self.args.archive,
-                                   move = self.args.move,
-                                   remove_duplicates = self.args.rm_duplicates)
         organizer_sucess = True
 
         if self.args.dry_run:
+            # dry runs don't change the target directory, so they don't take the lease
+            with profiler.span('scan'):
+                fetcher.file_list = fetcher.scan()
             reporter.dry_run()
+            with profiler.span('save_manifest'):
+                fetcher.save_manifest()
         elif self.args.archive and self.args.move:
             reporter.logger.error("Cannot archive and move at the same time. Please choose one or the other.")
             organizer_sucess = False
         else:
-            organizer_sucess = organizer.organize_files()["all"]
+            settings = fetcher.settings
+            lease = DirectoryLease(fetcher.get_target_directory(), reporter,
+                                   heartbeat_interval = settings.get('lease_heartbeat_interval', 10),
+                                   stale_after = settings.get('lease_stale_after', 300))
+            with profiler.span('acquire_lease'):
+                lease_acquired = self.acquire_lease(lease, reporter, settings)
+            if not lease_acquired:
+                return
+            try:
+                organizer_sucess = self.organize(reporter, fetcher, lease, self.get_request())
+                # run the work handed over by overlapping runs before giving up the lease
+                while True:
+                    requests = lease.take_queued()
+                    if not requests:
+                        break
+                    for request in requests:
+                        reporter.logger.info(f'Running request queued by pid {request["pid"]}...')
+                        fetcher = DataFetcher( fileIOreporter = reporter, 
+                                               settings_file = './Settings.yaml', 
+                                               path_to_extensions_file = './Extensions.yaml', 
+                                               target_directory = fetcher.get_target_directory(),
+                                               full_scan = request['full_scan'],
+                                               scan_on_init = False)
+                        reporter.fetcher = fetcher
+                        organizer_sucess = self.organize(reporter, fetcher, lease, request) and organizer_sucess
+            finally:
+                lease.release()
 
         if organizer_sucess:
             reporter.logger.info("Finished without errors.")
         else:
             reporter.logger.error("Finished with errors.")
 
+    def get_request(self):
+        """
+        Returns the options of this run that a lease holder needs to run it for us, see DirectoryLease.enqueue.
+        """
+        return {'pid': os.getpid(),
+                'archive': self.args.archive,
+                'move': self.args.move,
+                'rm_duplicates': self.args.rm_duplicates,
+                'conflict_policy': self.args.conflict_policy,
+                'durability': self.args.durability,
+                'full_scan': self.args.full_scan}
+
+    def acquire_lease(self, lease, reporter, settings):
+        """
+        Acquires the lease on the target directory. If another run holds it, depending on --if-locked this run
+        exits, waits for the lease, or queues its work for the holder.
+
+        returns: True if this run should organize the target directory
+        """
+        if lease.acquire():
+            return True
+
+        mode = self.args.if_locked or settings.get('lease_contention', 'exit')
+        holder = lease.get_holder() or {}
+        reporter.logger.info(f'Another run (pid {holder.get("pid")} on {holder.get("host")}) is organizing the target directory.')
+
+        if mode == 'wait':
+            timeout = settings.get('lease_wait_timeout', None)
+            reporter.logger.info('Waiting for it to finish...')
+            if lease.wait(timeout):
+                return True
+            reporter.logger.error(f'Timed out after {timeout} seconds. Exiting...')
+            return False
+        if mode == 'queue':
+            if not lease.enqueue(self.get_request()):
+                # the other run finished in the meantime
+                return True
+            reporter.logger.info('Queued this run for it. Exiting...')
+            return False
+        reporter.logger.info('Exiting...')
+        return False
+
+    def organize(self, reporter, fetcher, lease, request):
+        """
+        Scans the target directory and organizes it with the options of a request, see get_request.
+
+        returns: True if all operations were successful
+        """
+        profiler = reporter.profiler
+        lease.report_progress()
+        with profiler.span('scan'):
+            fetcher.file_list = fetcher.scan()
+        organizer = FileOrganizer( fileIOreporter = reporter,
+                                   data_fetcher= fetcher,
+                                   archive = request['archive'],
+                                   move = request['move'],
+                                   remove_duplicates = request['rm_duplicates'],
+                                   conflict_policy = request['conflict_policy'],
+                                   durability = request['durability'],
+                                   lease = lease)
+        organizer_sucess = organizer.organize_files()["all"]
+        lease.report_progress()
+        with profiler.span('save_manifest'):
+            fetcher.refresh_directory_mtime()
+            fetcher.save_manifest()
+        with profiler.span('save_extension_registry'):
+            fetcher.extension_registry.save()
+        return organizer_sucess
+
 # main
 if __name__ == '__main__':
 
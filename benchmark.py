@@ -0,0 +1,102 @@
+"""
+Measures the throughput of moving and archiving files for each durability level.
+
+For every level a fresh target directory is filled with generated files, which are then
+moved (-m) or archived (-a) by FileOrganizer. Archiving is measured against an archive that
+already holds --existing files, since batched and strict copy the archive on every commit.
+
+usage: python benchmark.py [--files N] [--size BYTES] [--existing N] [--directory DIR]
+"""
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import yaml
+
+from Porgan import DataFetcher, FileIOReporter, FileOrganizer, DURABILITY_LEVELS
+
+EXTENSIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Extensions.yaml')
+# one extension per category, so files are spread over a few folders/archives
+BENCHMARK_EXTENSIONS = ['txt', 'png', 'mp3', 'mp4']
+
+
+def create_files(target_directory, count, size, prefix = 'file'):
+    data = os.urandom(size)
+    for n in range(count):
+        ext = BENCHMARK_EXTENSIONS[n % len(BENCHMARK_EXTENSIONS)]
+        with open(os.path.join(target_directory, f'{prefix}{n}.{ext}'), 'wb') as f:
+            f.write(data)
+
+
+def run(work_directory, mode, durability, files, size, existing):
+    """
+    Runs one move or archive of generated files.
+
+    parameters: work_directory (str) - the directory to create the target directory in
+                mode (str) - 'move' or 'archive'
+                durability (str) - the durability level
+                files (int) - the number of files to organize
+                size (int) - the size of each file in bytes
+                existing (int) - the number of files already in each archive
+
+    returns: the run time in seconds
+    """
+    target_directory = os.path.join(work_directory, f'{mode}-{durability}')
+    os.makedirs(target_directory)
+    settings_file = os.path.join(work_directory, 'Settings.yaml')
+    with open(settings_file, 'w') as f:
+        yaml.safe_dump({'target_directory': target_directory,
+                        'delete_redundant_files': False,
+                        'delete_duplicate_files': False,
+                        'rename_orphaned_duplicates': False,
+                        'incremental_mode': False,
+                        'conflict_policy': 'rename',
+                        'durability': durability,
+                        'durability_batch_size': 100}, f)
+
+    reporter = FileIOReporter(target_directory, move_mode=mode == 'move', archive_mode=mode == 'archive',
+                              remove_duplicates_mode=False, log_level=logging.WARNING)
+
+    if mode == 'archive' and existing:
+        # fill the archives first, so the measured run appends to archives that are not empty
+        create_files(target_directory, existing, size, prefix='existing')
+        fetcher = DataFetcher(reporter, settings_file, EXTENSIONS_FILE, target_directory)
+        FileOrganizer(reporter, fetcher, archive=True, durability='none').organize_files()
+
+    create_files(target_directory, files, size)
+    fetcher = DataFetcher(reporter, settings_file, EXTENSIONS_FILE, target_directory)
+    organizer = FileOrganizer(reporter, fetcher, archive=mode == 'archive', move=mode == 'move')
+
+    start = time.perf_counter()
+    result = organizer.organize_files()
+    elapsed = time.perf_counter() - start
+    if not result['all']:
+        print(f'{mode} {durability}: finished with errors')
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures move/archive throughput for each durability level.')
+    parser.add_argument('--files', type=int, default=1000, help='Number of files to organize. Default is 1000')
+    parser.add_argument('--size', type=int, default=64 * 1024, help='Size of each file in bytes. Default is 64 KiB')
+    parser.add_argument('--existing', type=int, default=1000, help='Number of files already in each archive. Default is 1000')
+    parser.add_argument('--directory', type=str, default=None, help='Directory to run in, use a directory on the disk to measure')
+    args = parser.parse_args()
+
+    work_directory = tempfile.mkdtemp(prefix='porgan-benchmark-', dir=args.directory)
+    try:
+        print(f'{args.files} files of {args.size} bytes in {work_directory}')
+        print(f'{"mode":<8} {"durability":<10} {"seconds":>8} {"files/s":>10} {"MB/s":>8}')
+        for mode in ['move', 'archive']:
+            for durability in DURABILITY_LEVELS:
+                elapsed = run(work_directory, mode, durability, args.files, args.size, args.existing)
+                print(f'{mode:<8} {durability:<10} {elapsed:>8.3f} {args.files / elapsed:>10.0f} {args.files * args.size / elapsed / 1e6:>8.1f}')
+    finally:
+        shutil.rmtree(work_directory)
+
+
+if __name__ == '__main__':
+    main()